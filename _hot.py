@@ -0,0 +1,100 @@
+"""
+Per-feature normalization helpers
+
+Kept free of FastAPI/pydantic imports so this module can be compiled with mypyc.
+start_server.sh does that when COMPILE_HOT=1 (`mypyc _hot.py`); the compiled
+extension is then picked up automatically, otherwise the plain module is used.
+"""
+
+import re
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# SF codes must not touch other letters/digits ("_" and "-" count as separators),
+# and SINGLE may run straight into FAM(ILY):
+#
+#   SINGLE FAMILY, SINGLE_FAMILY, SingleFamily, single-family  -> match
+#   SF, SFR, SFD, SFRES, SF_RES, A1 - SF                        -> match
+#   TRANSFER, SFX, COMMERCIAL, MULTI FAMILY                     -> no match
+SF_RE = re.compile(
+    r"(?<![A-Z0-9])(?:SINGLE|SF(?:RES|R|D)?)(?![A-Z0-9])|SINGLE[\s_-]?FAM",
+    re.IGNORECASE,
+)
+
+SF_KEYS: Tuple[str, ...] = (
+    "LAND_USE",
+    "LandUse",
+    "PROPERTY_CLASS",
+    "PropertyClass",
+    "PROP_CLASS",
+    "PropClass",
+    "PROPERTY_TYPE",
+)
+
+
+def is_single_family(attrs: Dict[str, Any]) -> bool:
+    for k in SF_KEYS:
+        v = attrs.get(k)
+        if v and SF_RE.search(str(v)):
+            return True
+    return False
+
+
+def norm_float(val: Any) -> Optional[float]:
+    try:
+        if val is None:
+            return None
+        return float(val)
+    except Exception:
+        return None
+
+
+def norm_int(val: Any) -> Optional[int]:
+    try:
+        if val is None:
+            return None
+        return int(float(val))
+    except Exception:
+        return None
+
+
+# (record field, candidate source keys in priority order, coercer). Mirrors an
+# `a or b or c` chain: the first truthy value wins, else the last one is kept.
+FIELD_MAP: Tuple[Tuple[str, Tuple[str, ...], Callable[[Any], Any]], ...] = (
+    ("parcel_id", ("PARCEL_ID", "ParcelID", "ACCOUNT", "Account", "OBJECTID"), str),
+    ("address", ("SITUS_ADDR", "SitusAddress", "SITUS", "Address"), str),
+    ("owner", ("OWNER", "OwnerName", "OWNER_NAME"), str),
+    ("land_value", ("LAND_VALUE", "LandValue", "LANDVAL"), norm_float),
+    ("improvement_value", ("IMPR_VALUE", "ImprovementValue", "IMPRVAL"), norm_float),
+    (
+        "total_appraised_value",
+        ("TOTAL_VALUE", "TotalValue", "MKT_VAL", "APPR_VALUE", "ApprValue"),
+        norm_float,
+    ),
+    ("year_built", ("YEAR_BUILT", "YearBuilt"), norm_int),
+    ("lot_size", ("LOT_SIZE", "LotSize", "ACRES", "Acres"), norm_float),
+    ("legal_description", ("LEGAL_DESC", "LegalDesc", "LEGAL_DESCRIPTION"), str),
+    ("property_class", ("PROPERTY_CLASS", "PropClass", "PROP_CLASS"), str),
+    ("land_use", ("LAND_USE", "LandUse"), str),
+)
+
+
+def normalize_feature(feature: Dict[str, Any]) -> Dict[str, Any]:
+    """Map an ArcGIS feature to PropertyRecord field values, already coerced"""
+    attrs: Dict[str, Any] = feature.get("attributes", {})
+    geom: Dict[str, Any] = feature.get("geometry", {}) or {}
+    x = geom.get("x")
+    y = geom.get("y")
+
+    # Try multiple common field names
+    fields: Dict[str, Any] = {}
+    for name, keys, coerce in FIELD_MAP:
+        v: Any = None
+        for k in keys:
+            v = attrs.get(k)
+            if v:
+                break
+        fields[name] = coerce(v) if v is not None else None
+
+    fields["longitude"] = float(x) if isinstance(x, (int, float)) else None
+    fields["latitude"] = float(y) if isinstance(y, (int, float)) else None
+    return fields
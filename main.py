@@ -1,15 +1,60 @@
+import asyncio
 import os
-from io import BytesIO
-from typing import Any, Dict, List, Optional
-
-import requests
-from fastapi import FastAPI, HTTPException
+import tempfile
+from contextlib import asynccontextmanager
+from typing import IO, Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import cachetools
+import httpx
+import orjson
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, HTMLResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import HTMLResponse, ORJSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
+from starlette.background import BackgroundTask
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# Compiled with mypyc when built via COMPILE_HOT=1 in start_server.sh, plain Python otherwise
+from _hot import FIELD_MAP, SF_KEYS, is_single_family, normalize_feature
 
 # ---------- App Setup ----------
-app = FastAPI()
+USER_AGENT = "flames-blue-dcad-app/1.0 (contact: support@flames.blue)"
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled client per process so upstream connections are kept alive
+    # Limits must go on the transport: httpx ignores client-level limits when a
+    # custom transport is passed. Transport retries cover connection failures only.
+    app.state.http = httpx.AsyncClient(
+        timeout=30,
+        headers={"User-Agent": USER_AGENT},
+        transport=httpx.AsyncHTTPTransport(
+            retries=3,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+        ),
+    )
+    yield
+    await app.state.http.aclose()
+
+
+class SelectiveGZipMiddleware:
+    """GZipMiddleware that skips the given paths (e.g. already-zipped downloads)"""
+
+    def __init__(self, app: ASGIApp, exclude_paths: Iterable[str] = (), **gzip_options: Any) -> None:
+        self.app = app
+        self.gzip = GZipMiddleware(app, **gzip_options)
+        self.exclude_paths = frozenset(exclude_paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["path"] not in self.exclude_paths:
+            await self.gzip(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -18,6 +63,14 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Parcel lists compress ~5-10x; level 5 keeps CPU cost negligible. The .xlsx
+# export is already a zip archive, so it is sent as-is.
+app.add_middleware(
+    SelectiveGZipMiddleware,
+    exclude_paths={"/api/properties/export"},
+    minimum_size=1024,
+    compresslevel=5,
+)
 
 
 # ---------- Models ----------
@@ -26,6 +79,8 @@ class SearchRequest(BaseModel):
     county: str = Field("Denton County, TX", description="County and state")
     radius_miles: float = Field(2.0, gt=0, description="Search radius in miles")
     single_family_only: bool = Field(True, description="Filter to single-family homes")
+    lat: Optional[float] = Field(None, ge=-90, le=90, description="Latitude hint; skips geocoding when given with lon")
+    lon: Optional[float] = Field(None, ge=-180, le=180, description="Longitude hint; skips geocoding when given with lat")
 
 
 class PropertyRecord(BaseModel):
@@ -46,25 +101,80 @@ class PropertyRecord(BaseModel):
 
 # ---------- Helpers ----------
 NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
-USER_AGENT = "flames-blue-dcad-app/1.0 (contact: support@flames.blue)"
 
+RETRY_STATUSES = frozenset({502, 503, 504})
+RETRY_ATTEMPTS = 3
+RETRY_BACKOFF = 0.2
+
+# Geocodes are stable and Nominatim allows ~1 req/s, so remember them for a day.
+# Only touched from the event loop, so no lock is needed.
+_GEOCODE_CACHE: cachetools.TTLCache = cachetools.TTLCache(maxsize=10_000, ttl=86400)
+
+# Raw CAD features keyed by rounded point (~11m) and radius; Search -> Export
+# re-runs the same query back to back.
+_CAD_CACHE: cachetools.TTLCache = cachetools.TTLCache(maxsize=2000, ttl=3600)
+
+# Final record lists, keyed like _CAD_CACHE plus single_family_only, so Export
+# right after Search skips dedupe/filter/normalize too.
+_RECORDS_CACHE: cachetools.TTLCache = cachetools.TTLCache(maxsize=2000, ttl=600)
+
+
+def _area_key(lon: float, lat: float, radius_miles: float) -> Tuple[float, float, float]:
+    return (round(lon, 4), round(lat, 4), radius_miles)
+
+
+# Every attribute normalize/is_single_family can read
+_OUT_FIELDS = frozenset({k for _, keys, _ in FIELD_MAP for k in keys} | set(SF_KEYS) | {"OBJECTID"})
+
+
+class LayerInfo(NamedTuple):
+    out_fields: str
+    oid_field: Optional[str]
+    supports_pagination: bool
+    supports_order_by: bool
+
+
+# What a layer URL can do, resolved from its metadata. The fallback (outFields "*",
+# unpaged query) is cached too, so an unhealthy schema endpoint is probed at most
+# once per TTL rather than before every search.
+_FALLBACK_LAYER_INFO = LayerInfo("*", None, False, False)
+_LAYER_INFO: cachetools.TTLCache = cachetools.TTLCache(maxsize=16, ttl=600)
+
+
+async def _get_with_retry(http: httpx.AsyncClient, url: str, **kwargs: Any) -> httpx.Response:
+    # Retry transient upstream gateway errors with exponential backoff
+    for attempt in range(RETRY_ATTEMPTS):
+        r = await http.get(url, **kwargs)
+        if r.status_code not in RETRY_STATUSES:
+            break
+        await asyncio.sleep(RETRY_BACKOFF * 2**attempt)
+    else:
+        r = await http.get(url, **kwargs)
+    return r
+
+
+async def geocode_address(http: httpx.AsyncClient, address: str) -> Dict[str, float]:
+    key = " ".join(address.lower().split())
+    cached = _GEOCODE_CACHE.get(key)
+    if cached is not None:
+        return cached
 
-def geocode_address(address: str) -> Dict[str, float]:
     params = {
         "q": address,
         "format": "json",
         "limit": 1,
         "addressdetails": 1,
     }
-    headers = {"User-Agent": USER_AGENT}
-    r = requests.get(NOMINATIM_URL, params=params, headers=headers, timeout=20)
+    r = await _get_with_retry(http, NOMINATIM_URL, params=params, timeout=20)
     if r.status_code != 200:
         raise HTTPException(status_code=502, detail=f"Geocoding failed: {r.text[:200]}")
-    results = r.json()
+    results = orjson.loads(r.content)
     if not results:
         raise HTTPException(status_code=404, detail="Address not found")
     item = results[0]
-    return {"lat": float(item["lat"]), "lon": float(item["lon"])}
+    coords = {"lat": float(item["lat"]), "lon": float(item["lon"])}
+    _GEOCODE_CACHE[key] = coords
+    return coords
 
 
 class DentonCADClient:
@@ -80,16 +190,67 @@ class DentonCADClient:
         "https://gis.dentoncounty.gov/arcgis/rest/services/DCAD_public/MapServer/0",
     )
 
-    def __init__(self) -> None:
+    # Features requested per page, and how many page requests may be in flight at
+    # once per search so dense areas don't flood the county server
+    PAGE_SIZE = 500
+    MAX_CONCURRENT_PAGES = 4
+
+    def __init__(self, http: httpx.AsyncClient) -> None:
         self.layer_url = self.DEFAULT_LAYER_URL
-        self.session = requests.Session()
-        self.session.headers.update({"User-Agent": USER_AGENT})
+        self.http = http
 
     @staticmethod
     def miles_to_meters(miles: float) -> float:
         return miles * 1609.34
 
-    def query_nearby(self, lon: float, lat: float, radius_miles: float) -> List[Dict[str, Any]]:
+    async def layer_info(self) -> LayerInfo:
+        """
+        outFields (the subset of _OUT_FIELDS the layer actually has, since ArcGIS
+        rejects unknown names), object-id field and paging support. Falls back to
+        "*" and a plain unpaged query if the metadata can't be read.
+        """
+        cached = _LAYER_INFO.get(self.layer_url)
+        if cached is not None:
+            return cached
+
+        # Single best-effort probe; the fallback always works, so don't retry or wait long
+        info = _FALLBACK_LAYER_INFO
+        try:
+            r = await self.http.get(self.layer_url, params={"f": "json"}, timeout=10)
+            if r.status_code == 200:
+                info = self._parse_layer_info(orjson.loads(r.content))
+        except (httpx.HTTPError, ValueError, KeyError, TypeError, AttributeError):
+            pass
+
+        _LAYER_INFO[self.layer_url] = info
+        return info
+
+    @staticmethod
+    def _parse_layer_info(meta: Dict[str, Any]) -> LayerInfo:
+        fields = meta.get("fields") or []
+        available = {f["name"] for f in fields}
+        oid_field = meta.get("objectIdField") or next(
+            (f["name"] for f in fields if f.get("type") == "esriFieldTypeOID"), None
+        )
+        caps = meta.get("advancedQueryCapabilities") or {}
+
+        wanted = available & _OUT_FIELDS
+        if oid_field:
+            wanted.add(oid_field)
+        return LayerInfo(
+            out_fields=",".join(sorted(wanted)) if wanted else "*",
+            oid_field=oid_field,
+            supports_pagination=bool(caps.get("supportsPagination")),
+            supports_order_by=bool(caps.get("supportsOrderBy")),
+        )
+
+    async def query_nearby(self, lon: float, lat: float, radius_miles: float) -> List[Dict[str, Any]]:
+        key = _area_key(lon, lat, radius_miles)
+        cached = _CAD_CACHE.get(key)
+        if cached is not None:
+            return cached
+
+        info = await self.layer_info()
         params = {
             "f": "json",
             "where": "1=1",
@@ -99,116 +260,70 @@ class DentonCADClient:
             "spatialRel": "esriSpatialRelIntersects",
             "distance": self.miles_to_meters(radius_miles),
             "units": "esriSRUnit_Meter",
-            "outFields": "*",
+            "outFields": info.out_fields,
             "outSR": 4326,
             "returnGeometry": True,
+            "geometryPrecision": 6,
         }
-        r = self.session.get(f"{self.layer_url}/query", params=params, timeout=30)
+
+        if not info.supports_pagination:
+            # Layer can't page (or its capabilities are unknown): plain query as before
+            features = (await self._query(params)).get("features", [])
+            _CAD_CACHE[key] = features
+            return features
+
+        # Esri only guarantees stable paging with an explicit order
+        paged = dict(params)
+        if info.supports_order_by and info.oid_field:
+            paged["orderByFields"] = info.oid_field
+
+        # Most areas fit in one page. Only when the server reports truncation do we
+        # count and fetch the rest, using the page size it actually honoured (its
+        # maxRecordCount may be below PAGE_SIZE).
+        first = await self._query({**paged, "resultOffset": 0, "resultRecordCount": self.PAGE_SIZE})
+        features = list(first.get("features", []))
+        step = len(features)
+        if first.get("exceededTransferLimit") and step:
+            total = (await self._query({**params, "returnCountOnly": True})).get("count", 0)
+            semaphore = asyncio.Semaphore(self.MAX_CONCURRENT_PAGES)
+
+            async def fetch_page(offset: int) -> Dict[str, Any]:
+                async with semaphore:
+                    return await self._query({**paged, "resultOffset": offset, "resultRecordCount": step})
+
+            pages = await asyncio.gather(*[fetch_page(offset) for offset in range(step, total, step)])
+            features.extend(f for page in pages for f in page.get("features", []))
+
+        _CAD_CACHE[key] = features
+        return features
+
+    async def _query(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        r = await _get_with_retry(self.http, f"{self.layer_url}/query", params=params, timeout=30)
         if r.status_code != 200:
             raise HTTPException(status_code=502, detail=f"Denton CAD query failed: {r.text[:200]}")
-        data = r.json()
+        data = orjson.loads(r.content)
         if "error" in data:
             raise HTTPException(status_code=502, detail=f"Denton CAD error: {data['error']}")
-        features = data.get("features", [])
-        return features
+        return data
 
-    @staticmethod
-    def is_single_family(attrs: Dict[str, Any]) -> bool:
-        candidates = [
-            str(attrs.get("LAND_USE", "")),
-            str(attrs.get("LandUse", "")),
-            str(attrs.get("PROPERTY_CLASS", "")),
-            str(attrs.get("PropertyClass", "")),
-            str(attrs.get("PROP_CLASS", "")),
-            str(attrs.get("PropClass", "")),
-            str(attrs.get("PROPERTY_TYPE", "")),
-        ]
-        text = " ".join(candidates).upper()
-        return "SINGLE" in text or "SF" in text
+    is_single_family = staticmethod(is_single_family)
 
-    @staticmethod
-    def norm_float(val: Any) -> Optional[float]:
-        try:
-            if val is None:
-                return None
-            return float(val)
-        except Exception:
-            return None
+    def normalize(self, feature: Dict[str, Any]) -> PropertyRecord:
+        # Values are already coerced by normalize_feature, so skip pydantic validation
+        return PropertyRecord.model_construct(**normalize_feature(feature))
 
-    @staticmethod
-    def norm_int(val: Any) -> Optional[int]:
-        try:
-            if val is None:
-                return None
-            return int(float(val))
-        except Exception:
-            return None
 
-    def normalize(self, feature: Dict[str, Any]) -> PropertyRecord:
-        attrs = feature.get("attributes", {})
-        geom = feature.get("geometry", {}) or {}
-        x = geom.get("x")
-        y = geom.get("y")
-
-        # Try multiple common field names
-        parcel_id = (
-            attrs.get("PARCEL_ID")
-            or attrs.get("ParcelID")
-            or attrs.get("ACCOUNT")
-            or attrs.get("Account")
-            or attrs.get("OBJECTID")
-        )
-        address = (
-            attrs.get("SITUS_ADDR")
-            or attrs.get("SitusAddress")
-            or attrs.get("SITUS")
-            or attrs.get("Address")
-        )
-        owner = attrs.get("OWNER") or attrs.get("OwnerName") or attrs.get("OWNER_NAME")
-        land_value = self.norm_float(
-            attrs.get("LAND_VALUE") or attrs.get("LandValue") or attrs.get("LANDVAL")
-        )
-        impr_value = self.norm_float(
-            attrs.get("IMPR_VALUE") or attrs.get("ImprovementValue") or attrs.get("IMPRVAL")
-        )
-        total_val = self.norm_float(
-            attrs.get("TOTAL_VALUE")
-            or attrs.get("TotalValue")
-            or attrs.get("MKT_VAL")
-            or attrs.get("APPR_VALUE")
-            or attrs.get("ApprValue")
-        )
-        year_built = self.norm_int(attrs.get("YEAR_BUILT") or attrs.get("YearBuilt"))
-        lot_size = self.norm_float(
-            attrs.get("LOT_SIZE") or attrs.get("LotSize") or attrs.get("ACRES") or attrs.get("Acres")
-        )
-        legal_description = (
-            attrs.get("LEGAL_DESC") or attrs.get("LegalDesc") or attrs.get("LEGAL_DESCRIPTION")
-        )
-        prop_class = attrs.get("PROPERTY_CLASS") or attrs.get("PropClass") or attrs.get("PROP_CLASS")
-        land_use = attrs.get("LAND_USE") or attrs.get("LandUse")
-
-        return PropertyRecord(
-            parcel_id=str(parcel_id) if parcel_id is not None else None,
-            address=str(address) if address is not None else None,
-            owner=str(owner) if owner is not None else None,
-            land_value=land_value,
-            improvement_value=impr_value,
-            total_appraised_value=total_val,
-            year_built=year_built,
-            lot_size=lot_size,
-            legal_description=str(legal_description) if legal_description is not None else None,
-            property_class=str(prop_class) if prop_class is not None else None,
-            land_use=str(land_use) if land_use is not None else None,
-            longitude=float(x) if isinstance(x, (int, float)) else None,
-            latitude=float(y) if isinstance(y, (int, float)) else None,
-        )
+# xlsxwriter is only needed for exports; imported on first use
+_xlsxwriter: Any = None
+
 
+def to_excel(records: List[PropertyRecord]) -> IO[bytes]:
+    global _xlsxwriter
+    if _xlsxwriter is None:
+        import xlsxwriter
 
-def to_excel(records: List[PropertyRecord]) -> bytes:
-    import pandas as pd
+        _xlsxwriter = xlsxwriter
 
-    df = pd.DataFrame([r.model_dump() for r in records])
     # Order columns nicely
     preferred = [
         "parcel_id",
@@ -225,63 +340,105 @@ def to_excel(records: List[PropertyRecord]) -> bytes:
         "latitude",
         "longitude",
     ]
-    cols = [c for c in preferred if c in df.columns] + [c for c in df.columns if c not in preferred]
-    df = df[cols]
-
-    buf = BytesIO()
-    with pd.ExcelWriter(buf, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False, sheet_name="Properties")
+    cols = preferred + [c for c in PropertyRecord.model_fields if c not in preferred]
+
+    # Stays in memory for typical exports, spills to disk for very large ones
+    buf = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    # Rows are written strictly in order, so constant_memory flushes each one as it goes
+    wb = _xlsxwriter.Workbook(buf, {"constant_memory": True})
+    ws = wb.add_worksheet("Properties")
+    ws.write_row(0, 0, cols)
+    for i, r in enumerate(records, 1):
+        ws.write_row(i, 0, [getattr(r, c) for c in cols])
+    wb.close()
     buf.seek(0)
-    return buf.read()
+    return buf
 
 
-# ---------- Routes ----------
-@app.get("/")
-def read_root():
-    return {"message": "Property search backend is running"}
+def iter_file(f: IO[bytes], chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    while chunk := f.read(chunk_size):
+        yield chunk
 
 
-@app.post("/api/properties/search", response_model=List[PropertyRecord])
-def search_properties(req: SearchRequest):
-    # Geocode
-    coords = geocode_address(f"{req.address}, {req.county}")
+async def _search_records(req: SearchRequest, http: httpx.AsyncClient) -> List[PropertyRecord]:
+    # Geocode, unless the caller already knows the coordinates
+    if req.lat is not None and req.lon is not None:
+        coords = {"lat": req.lat, "lon": req.lon}
+    else:
+        coords = await geocode_address(http, f"{req.address}, {req.county}")
+
+    key = (*_area_key(coords["lon"], coords["lat"], req.radius_miles), req.single_family_only)
+    cached = _RECORDS_CACHE.get(key)
+    if cached is not None:
+        return cached
 
     # Query CAD
-    client = DentonCADClient()
-    features = client.query_nearby(coords["lon"], coords["lat"], req.radius_miles)
+    client = DentonCADClient(http)
+    features = await client.query_nearby(coords["lon"], coords["lat"], req.radius_miles)
+
+    # Drop duplicate parcels (edge-straddling geometry, overlapping pages)
+    oid_field = (await client.layer_info()).oid_field or "OBJECTID"
+    seen = set()
+    deduped = []
+    for f in features:
+        oid = f.get("attributes", {}).get(oid_field)
+        if oid is not None:
+            if oid in seen:
+                continue
+            seen.add(oid)
+        deduped.append(f)
+    features = deduped
+
+    # Filter single-family if requested, before paying for normalization
+    if req.single_family_only:
+        features = [f for f in features if client.is_single_family(f.get("attributes", {}))]
 
     # Normalize
     records = [client.normalize(f) for f in features]
 
-    # Filter single-family if requested
-    if req.single_family_only:
-        records = [r for r, f in zip(records, features) if client.is_single_family(f.get("attributes", {}))]
-
+    _RECORDS_CACHE[key] = records
     return records
 
 
+# ---------- Routes ----------
+@app.get("/")
+def read_root():
+    return {"message": "Property search backend is running"}
+
+
+@app.post("/api/properties/search", response_model=List[PropertyRecord])
+async def search_properties(req: SearchRequest, request: Request):
+    return await _search_records(req, request.app.state.http)
+
+
 @app.post("/api/properties/export")
-def export_properties(req: SearchRequest):
+async def export_properties(req: SearchRequest, request: Request):
     # Reuse search logic
-    results = search_properties(req)
+    results = await _search_records(req, request.app.state.http)
 
     if not results:
         raise HTTPException(status_code=404, detail="No properties found for the specified criteria")
 
-    xlsx = to_excel(results)
+    # Workbook building is CPU-bound; keep it off the event loop
+    xlsx = await asyncio.to_thread(to_excel, results)
 
     filename = "denton_properties.xlsx"
     headers = {
         "Content-Disposition": f"attachment; filename={filename}",
         "Content-Type": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
     }
-    return StreamingResponse(BytesIO(xlsx), headers=headers, media_type=headers["Content-Type"]) 
+    # Closed by the response once sending ends, including on client disconnect
+    return StreamingResponse(
+        iter_file(xlsx),
+        headers=headers,
+        media_type=headers["Content-Type"],
+        background=BackgroundTask(xlsx.close),
+    )
 
 
-@app.get("/ui", response_class=HTMLResponse)
-def simple_ui():
-    # Lightweight UI served from backend as a fallback while frontend is unavailable
-    html = """
+# Lightweight UI served from backend as a fallback while frontend is unavailable.
+# Encoded once at import instead of on every request.
+_UI_HTML = """
     <!doctype html>
     <html>
     <head>
@@ -461,7 +618,12 @@ def simple_ui():
     </body>
     </html>
     """
-    return HTMLResponse(content=html, status_code=200)
+_UI_HTML_BYTES = _UI_HTML.encode("utf-8")
+
+
+@app.get("/ui", response_class=HTMLResponse)
+def simple_ui():
+    return HTMLResponse(content=_UI_HTML_BYTES, headers={"Cache-Control": "public, max-age=300"})
 
 
 @app.get("/test")
@@ -478,4 +640,13 @@ if __name__ == "__main__":
     import uvicorn
 
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=port,
+        # "auto" uses uvloop when installed (not available on Windows)
+        loop="auto",
+        http="httptools",
+        # Caches are per process; more workers make Search -> Export miss them
+        workers=int(os.getenv("WEB_CONCURRENCY", 1)),
+    )
@@ -14,6 +14,11 @@ fi
 mkdir -p logs
 echo "Installing dependencies..."
 pip install -r requirements.txt
+if [ "${COMPILE_HOT:-0}" = "1" ]; then
+  # Optional: compile the per-feature hot path; main.py falls back to _hot.py if this fails
+  echo "Compiling _hot.py with mypyc..."
+  pip install mypy && mypyc _hot.py || echo "mypyc build failed; using pure Python _hot.py"
+fi
 echo "Starting FastAPI server..."
-nohup uvicorn main:app --host 0.0.0.0 --port 8000 --reload > logs/server.log 2>&1 
+nohup uvicorn main:app --host 0.0.0.0 --port 8000 --loop auto --http httptools --reload > logs/server.log 2>&1 
 echo "Server started in background"